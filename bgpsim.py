@@ -1,18 +1,32 @@
 from __future__ import annotations
 
+import array
 import bz2
-import copy
 import dataclasses
 import enum
+import functools
+import itertools
 import logging
+import multiprocessing
+import operator
 import os
+import pickle
+import re
 from collections import Counter, defaultdict
-from typing import Any, Callable
+from collections.abc import Mapping
+from typing import Any, Callable, Iterable, Iterator
 
 import networkx as nx
 
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
 ASPath = tuple[int, ...]
-ImportFilter = Callable[[int, list[ASPath], Any], list[ASPath]]
+ImportFilter = Callable[[int, list[ASPath], Any], Iterable[ASPath]]
+FrozenAnnouncement = tuple[tuple[int, tuple[tuple[int, ASPath], ...]], ...]
 
 NODE_PATH_PREF = "path-pref"
 NODE_BEST_PATHS = "best-paths"
@@ -20,6 +34,7 @@ NODE_PATH_LEN = "path-len"
 NODE_IMPORT_FILTER = "import-filter"
 NODE_HAS_PROVIDER = "has-provider"
 EDGE_REL = "edge-attr-relationship"
+INFERENCE_CACHE_SIZE = 16
 
 
 class PathPref(enum.IntEnum):
@@ -37,14 +52,8 @@ class PathPref(enum.IntEnum):
     @staticmethod
     def from_relationship(graph: ASGraph, exporter: int, importer: int) -> PathPref:
         """Compute the PathPref at importer given the relationship in the ASGraph."""
-        rel = graph.g[importer][exporter][EDGE_REL]
-        if rel == Relationship.P2C:
-            return PathPref.CUSTOMER
-        if rel == Relationship.P2P:
-            return PathPref.PEER
-        if rel == Relationship.C2P:
-            return PathPref.PROVIDER
-        raise ValueError(f"Unsupported relationship {rel}")
+        graph.finalize()
+        return PATH_PREFS[graph.edge_pref[importer, exporter]]
 
 
 class Relationship(enum.IntEnum):
@@ -68,6 +77,34 @@ class Relationship(enum.IntEnum):
         return Relationship(-1 * self.value)
 
 
+# Plain int values for hot loops, where comparisons against IntEnum members are
+# noticeably slower than comparisons between ints. The public API uses the enums.
+PATH_PREF_CUSTOMER = int(PathPref.CUSTOMER)
+PATH_PREF_PEER = int(PathPref.PEER)
+PATH_PREF_PROVIDER = int(PathPref.PROVIDER)
+PATH_PREF_UNKNOWN = int(PathPref.UNKNOWN)
+REL_C2P = int(Relationship.C2P)
+REL_P2P = int(Relationship.P2P)
+REL_P2C = int(Relationship.P2C)
+# PathPref members indexed by value; much cheaper than calling PathPref(value).
+PATH_PREFS = tuple(sorted(PathPref))
+
+
+class PathStorage(enum.Enum):
+    """How much of the best paths the inference keeps at each AS.
+
+    NONE only keeps path preferences and lengths; it does not support import
+    filters nor announcements poisoning ASes, which need to inspect paths.
+    PARENTS keeps the neighbors each AS learned best paths from, and builds
+    NODE_BEST_PATHS from them on demand. FULL also builds the best paths of all
+    ASes at the end of the inference.
+    """
+
+    NONE = "none"
+    PARENTS = "parents"
+    FULL = "full"
+
+
 class InferenceCallback(enum.Enum):
     """Callback hooks available in the inference algorithm
 
@@ -118,112 +155,511 @@ class Announcement:
         src2nei2path: dict[int, dict[int, ASPath]] = {}
         if isinstance(sources, list):
             sources = {asn: 0 for asn in sources}
+        # Read neighbors from the compact topology, this avoids building the
+        # networkx graph for graphs loaded with read_caida_asrel_graph().
+        asgraph.finalize()
+        indptr = asgraph.indptr
+        idx2asn = asgraph.idx2asn
         for src, prepend in sources.items():
-            src2nei2path[src] = {nei: prepend*(src,) for nei in asgraph.g[src]}
+            idx = asgraph.asn2idx[src]
+            neighbors = asgraph.neighbors[indptr[idx] : indptr[idx + 1]]
+            src2nei2path[src] = dict.fromkeys(
+                map(idx2asn.__getitem__, neighbors), prepend * (src,)
+            )
         return Announcement(src2nei2path)
 
+    def freeze(self) -> FrozenAnnouncement:
+        """Return a hashable version of the announcement."""
+        return tuple(
+            sorted(
+                (src, tuple(sorted(nei2path.items())))
+                for src, nei2path in self.source2neighbor2path.items()
+            )
+        )
+
+    @staticmethod
+    def thaw(frozen: FrozenAnnouncement) -> Announcement:
+        """Rebuild an announcement from the output of Announcement.freeze()."""
+        return Announcement({src: dict(nei2path) for src, nei2path in frozen})
+
+    def poisons(self) -> bool:
+        """Check if announced AS-paths contain ASes other than the sources."""
+        sources = self.source2neighbor2path
+        return any(
+            asn not in sources
+            for neighbor2path in sources.values()
+            for path in neighbor2path.values()
+            for asn in path
+        )
+
 
 class WorkQueue:
+    """Edges exporting paths, bucketed by the PathPref they induce and by depth.
+
+    Edges with pref are kept in buckets[pref][depth], where depth is the length of
+    the paths at the exporter. Inference consumes edges in increasing depth, so we
+    keep a cursor per pref at the smallest depth that may hold edges.
+    """
+
     def __init__(self):
-        self.pref2depth2edge = {
-            PathPref.CUSTOMER: defaultdict(list),
-            PathPref.PEER: defaultdict(list),
-            PathPref.PROVIDER: defaultdict(list),
-        }
+        # Indexed by PathPref value; the entry for PathPref.UNKNOWN is unused.
+        self.buckets: list[list[list[tuple[int, int]]]] = [[], [], [], []]
+        self.cur_depth = [0, 0, 0, 0]
 
     def get(self, pref: PathPref) -> tuple[int, int] | None:
         """Get the edge exporting the shortest paths with pref."""
-        if not self.pref2depth2edge[pref]:
-            return None
-        depth = min(self.pref2depth2edge[pref])
-        edge = self.pref2depth2edge[pref][depth].pop()
-        if not self.pref2depth2edge[pref][depth]:
-            del self.pref2depth2edge[pref][depth]
-        return edge
+        buckets = self.buckets[pref]
+        depth = self.cur_depth[pref]
+        while depth < len(buckets):
+            if buckets[depth]:
+                self.cur_depth[pref] = depth
+                return buckets[depth].pop()
+            depth += 1
+        self.cur_depth[pref] = depth
+        return None
+
+    def _grow(self, depth: int) -> None:
+        """Make sure there are buckets up to depth for all prefs."""
+        for buckets in self.buckets[PATH_PREF_PROVIDER:]:
+            buckets.extend([] for _ in range(len(buckets), depth + 1))
 
     def add_work(self, graph: ASGraph, exporter: int) -> None:
-        """Add work to forward paths at importer to downstream ASes"""
-        pref = graph.g.nodes[exporter][NODE_PATH_PREF]
-        for downstream in graph.g[exporter]:
-            downstream_pref = PathPref.from_relationship(graph, exporter, downstream)
-            if pref == PathPref.CUSTOMER or downstream_pref == PathPref.PROVIDER:
-                depth = graph.g.nodes[exporter][NODE_PATH_LEN]
-                edge = (exporter, downstream)
-                self.pref2depth2edge[downstream_pref][depth].append(edge)
+        """Add work to forward paths at exporter to downstream ASes.
+
+        Nodes are identified by their index in the graph's compact arrays
+        (see ASGraph.finalize()), and so are edges in the queue.
+        """
+        pref = graph.path_pref[exporter]
+        depth = graph.path_len[exporter]
+        if depth >= len(self.buckets[PATH_PREF_PROVIDER]):
+            self._grow(depth)
+        neighbors = graph.neighbors
+        prefs = graph.prefs
+        cur_depth = self.cur_depth
+        # Customer routes go to all neighbors, others only to customers.
+        if pref == PATH_PREF_CUSTOMER:
+            end = graph.indptr[exporter + 1]
+        else:
+            end = graph.customers_end[exporter]
+        for i in range(graph.indptr[exporter], end):
+            downstream_pref = prefs[i]
+            edge = (exporter, neighbors[i])
+            self.buckets[downstream_pref][depth].append(edge)
+            # Inference never adds work below the cursor, but keep get() correct.
+            if depth < cur_depth[downstream_pref]:
+                cur_depth[downstream_pref] = depth
 
     def check_work(self, graph: ASGraph, exporter: int) -> bool:
-        """Check all neighbors importing from exporter are in work queue"""
-        pref = graph.g.nodes[exporter][NODE_PATH_PREF]
-        for downstream in graph.g[exporter]:
-            downstream_pref = PathPref.from_relationship(graph, exporter, downstream)
-            if pref == PathPref.CUSTOMER or downstream_pref == PathPref.PROVIDER:
-                depth = graph.g.nodes[exporter][NODE_PATH_LEN]
-                edge = (exporter, downstream)
-                assert edge in self.pref2depth2edge[downstream_pref][depth]
+        """Check all neighbors importing from exporter are in work queue
+
+        This scans work buckets linearly and is only meant for debugging; callers
+        guard it with __debug__ so it is skipped under python -O.
+        """
+        pref = graph.path_pref[exporter]
+        depth = graph.path_len[exporter]
+        neighbors = graph.neighbors
+        prefs = graph.prefs
+        for i in range(graph.indptr[exporter], graph.indptr[exporter + 1]):
+            downstream_pref = prefs[i]
+            if pref == PATH_PREF_CUSTOMER or downstream_pref == PATH_PREF_PROVIDER:
+                edge = (exporter, neighbors[i])
+                assert edge in self.buckets[downstream_pref][depth]
         return True
 
 
+class NodeAttrs(Mapping):
+    """Read-only attributes of one AS, read from the ASGraph's arrays on access.
+
+    NODE_BEST_PATHS is built with ASGraph.reconstruct_paths(), and is None if the
+    ASGraph does not store paths (PathStorage.NONE). NODE_PATH_LEN is missing at
+    ASes without a route, as it was never set on them.
+    """
+
+    KEYS = (
+        NODE_BEST_PATHS,
+        NODE_PATH_PREF,
+        NODE_PATH_LEN,
+        NODE_IMPORT_FILTER,
+        NODE_HAS_PROVIDER,
+    )
+
+    __slots__ = ("graph", "asn", "idx")
+
+    def __init__(self, graph: ASGraph, asn: int):
+        self.graph = graph
+        self.asn = asn
+        self.idx = graph.asn2idx[asn]
+
+    def __getitem__(self, key: str) -> Any:
+        graph = self.graph
+        if key == NODE_PATH_LEN:
+            if graph.path_pref[self.idx] == PATH_PREF_UNKNOWN:
+                raise KeyError(key)
+            return graph.path_len[self.idx]
+        if key == NODE_PATH_PREF:
+            return PATH_PREFS[graph.path_pref[self.idx]]
+        if key == NODE_BEST_PATHS:
+            if graph.store_paths is PathStorage.NONE:
+                return None
+            return graph.reconstruct_paths(self.asn)
+        if key == NODE_IMPORT_FILTER:
+            return graph.import_filters.get(self.asn)
+        if key == NODE_HAS_PROVIDER:
+            return bool(graph.has_provider[self.idx])
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self.graph.path_pref[self.idx] == PATH_PREF_UNKNOWN:
+            return (key for key in self.KEYS if key != NODE_PATH_LEN)
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        if self.graph.path_pref[self.idx] == PATH_PREF_UNKNOWN:
+            return len(self.KEYS) - 1
+        return len(self.KEYS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class NodeView:
+    """Map ASNs to their inference state, mirroring networkx's G.nodes[asn][attr].
+
+    Attributes are read from the ASGraph's compact arrays when accessed (see
+    NodeAttrs), so reading NODE_PATH_LEN does not build any AS-paths.
+    """
+
+    __slots__ = ("graph",)
+
+    def __init__(self, graph: ASGraph):
+        self.graph = graph
+
+    def __getitem__(self, asn: int) -> NodeAttrs:
+        self.graph.finalize()
+        return NodeAttrs(self.graph, asn)
+
+    def __contains__(self, asn: object) -> bool:
+        self.graph.finalize()
+        return asn in self.graph.asn2idx
+
+    def __iter__(self):
+        self.graph.finalize()
+        return iter(self.graph.idx2asn)
+
+    def __len__(self) -> int:
+        self.graph.finalize()
+        return len(self.graph.idx2asn)
+
+
+class _NxNodeView(nx.reportviews.NodeView):
+    """networkx NodeView where G.nodes[asn] returns the ASGraph's NodeAttrs."""
+
+    __slots__ = ("_asgraph",)
+
+    def __init__(self, graph: _DiGraph):
+        super().__init__(graph)
+        self._asgraph = graph.asgraph
+
+    def __getitem__(self, n):
+        if self._asgraph is None or isinstance(n, slice):
+            return super().__getitem__(n)
+        return self._asgraph.nodes[n]
+
+
+class _DiGraph(nx.DiGraph):
+    """networkx graph of an ASGraph.
+
+    Node attributes are not stored in networkx: G.nodes[asn][attr] reads them
+    from the ASGraph (see NodeAttrs), so code using G.nodes keeps working.
+    """
+
+    def __init__(
+        self, incoming_graph_data=None, asgraph: ASGraph | None = None, **attr
+    ):
+        super().__init__(incoming_graph_data, **attr)
+        self.asgraph = asgraph
+
+    @property
+    def nodes(self) -> _NxNodeView:
+        return _NxNodeView(self)
+
+
 class ASGraph:
-    def __init__(self):
-        self.g = nx.DiGraph()
+    def __init__(self, store_paths: PathStorage = PathStorage.PARENTS):
+        self._g: nx.DiGraph | None = _DiGraph(asgraph=self)
         self.workqueue = WorkQueue()
         self.announce: Announcement | None = None
         self.callbacks: dict[InferenceCallback, Callable] = {}
         self.tier1s: set[int] = set()
         self.ixps: set[int] = set()
+        self.import_filters: dict[int, tuple[ImportFilter, Any]] = {}
+        self.nodes = NodeView(self)
+        # Run inference with the compiled kernel when numba is available and the
+        # announcement and graph configuration allow (see _jit_supported()).
+        self.use_jit = numba is not None
+        self.store_paths = store_paths
+        self._infer_frozen = functools.lru_cache(maxsize=INFERENCE_CACHE_SIZE)(
+            self._infer_frozen_uncached
+        )
+        # Settings the results in the _infer_frozen() cache were inferred with.
+        self._infer_config: tuple | None = None
+        # PathPref (as a plain int) of routes imported over each edge, keyed by
+        # (importer, exporter) ASNs. Fixed by the relationship in add_peering().
+        self.edge_pref: dict[tuple[int, int], int] = {}
+        # Set when edge_pref is shared with clones, add_peering() copies it first.
+        self._edge_pref_shared = False
+
+        # Compact topology built from self.g by finalize(), or directly by
+        # read_caida_asrel_graph(). Node i has neighbors
+        # neighbors[indptr[i]:indptr[i+1]], rels[j] is the Relationship of the
+        # edge from node i to neighbors[j], and prefs[j] the PathPref at
+        # neighbors[j] for routes exported by node i. Neighbors are sorted by
+        # relationship, customers first (up to customers_end[i]), then peers and
+        # providers.
+        self.finalized = False
+        self.asn2idx: dict[int, int] = {}
+        self.idx2asn: list[int] = []
+        self.indptr = array.array("i")
+        self.neighbors = array.array("i")
+        self.rels = array.array("b")
+        self.prefs = array.array("b")
+        self.customers_end = array.array("i")
+        self.has_provider = array.array("b")
+
+        # Per-node inference state, indexed like the compact topology. The best
+        # paths at node i are (exporter,) + p for each exporter in best_parents[i]
+        # and each best path p at the exporter, plus any paths in fixed_paths[i].
+        # The latter holds announced paths and imports trimmed by import filters or
+        # loop detection, where only some of the exporter's paths are usable.
+        # Nodes without paths have best_parents[i] set to None, which saves
+        # allocating a list per node on every reset. Nodes with paths have a list.
+        self.path_pref = array.array("b")
+        self.path_len = array.array("h")
+        self.best_parents: list[list[int] | None] = []
+        self.fixed_paths: dict[int, list[ASPath]] = {}
+        # Best paths are interned when built: path p is path_hops[p] followed by
+        # path p' = path_rest[p], and -1 is the empty path. Paths exported by a node
+        # get ids once and are shared by all its importers; tuples are only built
+        # when queried.
+        self.path_hops = array.array("I")
+        self.path_rest = array.array("i")
+        self.path_intern: dict[tuple[int, int], int] = {}
+        self.path_ids_cache: dict[int, array.array] = {}
+        self.exported_ids_cache: dict[int, array.array] = {}
+        self.path_asns_cache: dict[int, frozenset[int]] = {}
+        self.path_origins_cache: dict[int, frozenset[int]] = {}
+        # Set while the Python inference runs; paths read from callbacks may not be
+        # final yet, so reconstruct_paths() does not memoize them.
+        self._inferring = False
 
     def add_peering(self, source: int, sink: int, relationship: Relationship) -> None:
-        """Add nodes and edges corresponding to a peering relationship."""
+        """Add nodes and edges corresponding to a peering relationship.
+
+        The topology cannot change while the graph holds inference results, call
+        reset_inference() first.
+        """
         assert source != sink
-        data = self.g.get_edge_data(source, sink, None)
-        if data is not None:
-            if data[EDGE_REL] != relationship:
+        assert self.announce is None
+        pref = self.edge_pref.get((sink, source))
+        if pref is not None:
+            if pref != 2 + relationship:
                 raise ValueError("Duplicate edges with different relationships")
             return
-        if source not in self.g:
-            self.g.add_node(source)
-            self.g.nodes[source][NODE_BEST_PATHS] = []
-            self.g.nodes[source][NODE_PATH_PREF] = PathPref.UNKNOWN
-            self.g.nodes[source][NODE_IMPORT_FILTER] = None
-            self.g.nodes[source][NODE_HAS_PROVIDER] = False
-        if sink not in self.g:
-            self.g.add_node(sink)
-            self.g.nodes[sink][NODE_BEST_PATHS] = []
-            self.g.nodes[sink][NODE_PATH_PREF] = PathPref.UNKNOWN
-            self.g.nodes[sink][NODE_IMPORT_FILTER] = None
-            self.g.nodes[sink][NODE_HAS_PROVIDER] = False
+        if self._edge_pref_shared:
+            self.edge_pref = dict(self.edge_pref)
+            self._edge_pref_shared = False
         self.g.add_edge(source, sink)
         self.g[source][sink][EDGE_REL] = Relationship(relationship)
         self.g.add_edge(sink, source)
         self.g[sink][source][EDGE_REL] = relationship.reversed()
-        if relationship == Relationship.C2P:
-            self.g.nodes[source][NODE_HAS_PROVIDER] = True
-        elif relationship == Relationship.P2C:
-            self.g.nodes[sink][NODE_HAS_PROVIDER] = True
+        # Relationship.P2C (-1) makes sink learn PathPref.PROVIDER (1) routes and
+        # source learn PathPref.CUSTOMER (3) routes; P2P gives PEER (2) both ways.
+        self.edge_pref[sink, source] = 2 + relationship
+        self.edge_pref[source, sink] = 2 - relationship
+        self.finalized = False
+        self._infer_frozen.cache_clear()
+
+    @property
+    def g(self) -> nx.DiGraph:
+        """NetworkX view of the topology.
+
+        Graphs loaded with read_caida_asrel_graph() and clones of finalized
+        graphs go straight into the compact topology arrays; the networkx graph
+        is only built when first accessed.
+
+        Change the topology with add_peering() or by assigning a new graph to g.
+        Edits made in place on g (e.g., g.add_edge()) are not detected and are
+        ignored by the inference.
+        """
+        if self._g is None:
+            g = _DiGraph(asgraph=self)
+            g.add_nodes_from(self.idx2asn)
+            g.add_edges_from(
+                (tail, head, {EDGE_REL: rel}) for tail, head, rel in self.edges()
+            )
+            self._g = g
+        return self._g
+
+    @g.setter
+    def g(self, g: nx.DiGraph) -> None:
+        if isinstance(g, _DiGraph):
+            g.asgraph = self
+        self._g = g
+        self.finalized = False
+        self._infer_frozen.cache_clear()
+
+    def edges(self) -> Iterator[tuple[int, int, Relationship]]:
+        """Iterate over directed edges as (tail, head, Relationship of tail to head).
+
+        Edges are read from the compact topology, like g.edges.data(EDGE_REL) but
+        without building the networkx graph.
+        """
+        self.finalize()
+        rels = {rel.value: rel for rel in Relationship}
+        idx2asn = self.idx2asn
+        indptr = self.indptr
+        tails = itertools.chain.from_iterable(
+            itertools.repeat(asn, indptr[idx + 1] - indptr[idx])
+            for idx, asn in enumerate(idx2asn)
+        )
+        heads = map(idx2asn.__getitem__, self.neighbors)
+        return zip(tails, heads, map(rels.__getitem__, self.rels))
+
+    def finalize(self) -> None:
+        """Build the compact topology arrays and reset inference state.
+
+        The inference algorithm only touches these arrays and edge_pref, never
+        self.g; both are rebuilt from self.g here. This is called automatically when
+        needed, and is a no-op unless peerings were added or self.g was assigned
+        since the last call. Raises ValueError rather than discarding the results of
+        an inference.
+        """
+        if self.finalized:
+            return
+        if self.announce is not None:
+            raise ValueError("Topology changed after inference, reset it first")
+        self._infer_frozen.cache_clear()
+        tails = array.array("I")
+        heads = array.array("I")
+        rels = array.array("b")
+        edge_pref: dict[tuple[int, int], int] = {}
+        for tail, head, rel in self.g.edges.data(EDGE_REL):
+            tails.append(tail)
+            heads.append(head)
+            rels.append(rel)
+            edge_pref[head, tail] = 2 + rel
+        self.edge_pref = edge_pref
+        self._edge_pref_shared = False
+        self._build_topology(self.g, tails, heads, rels)
+
+    def _build_topology(
+        self,
+        asns: Iterable[int],
+        tails: array.array,
+        heads: array.array,
+        rels: array.array,
+    ) -> None:
+        """Build the compact topology from directed edges tail->head.
+
+        Node indexes follow the order of asns. Edges are grouped by tail and then
+        by relationship (customers, peers, providers) with a stable sort, so
+        neighbors with the same relationship keep their input order.
+        """
+        self.idx2asn = list(asns)
+        self.asn2idx = {asn: idx for idx, asn in enumerate(self.idx2asn)}
+        n = len(self.idx2asn)
+        tail_idx = array.array("i", map(self.asn2idx.__getitem__, tails))
+        keys = list(map(operator.add, map((4).__mul__, tail_idx), rels))
+        order = sorted(range(len(tail_idx)), key=keys.__getitem__)
+        self.neighbors = array.array(
+            "i", map(self.asn2idx.__getitem__, map(heads.__getitem__, order))
+        )
+        self.rels = array.array("b", map(rels.__getitem__, order))
+        # Routes exported over an edge are imported with PathPref 2 + rel.
+        self.prefs = array.array("b", map((2).__add__, self.rels))
+        degrees = Counter(tail_idx)
+        customers = Counter(itertools.compress(tail_idx, map(REL_P2C.__eq__, rels)))
+        peers = Counter(itertools.compress(tail_idx, map(REL_P2P.__eq__, rels)))
+        self.indptr = array.array("i", [0])
+        self.indptr.extend(itertools.accumulate(degrees[idx] for idx in range(n)))
+        self.customers_end = array.array(
+            "i", map(operator.add, self.indptr[:n], (customers[i] for i in range(n)))
+        )
+        peers_end = map(operator.add, self.customers_end, (peers[i] for i in range(n)))
+        self.has_provider = array.array(
+            "b", map(operator.ne, peers_end, self.indptr[1:])
+        )
+        self.finalized = True
+        self.reset_inference()
+
+    def reset_inference(self) -> None:
+        """Discard inference state so infer_paths() can be called again.
+
+        This is cheaper than cloning the graph for every announcement when results
+        of previous inferences are no longer needed.
+        """
+        if not self.finalized:
+            self.announce = None
+            self.finalize()
+            return
+        self.workqueue = WorkQueue()
+        self.announce = None
+        n = len(self.idx2asn)
+        self.path_pref = array.array("b", [PATH_PREF_UNKNOWN]) * n
+        self.path_len = array.array("h", [0]) * n
+        self.best_parents = [None] * n
+        self.fixed_paths = {}
+        self._inferring = False
+        self._reset_path_caches()
+
+    def _reset_path_caches(self) -> None:
+        self.path_hops = array.array("I")
+        self.path_rest = array.array("i")
+        self.path_intern = {}
+        self.path_ids_cache = {}
+        self.exported_ids_cache = {}
+        self.path_asns_cache = {}
+        self.path_origins_cache = {}
 
     def set_import_filter(self, asn: int, func: ImportFilter, data: Any = None) -> None:
         """Set import filter for an AS.
 
         The filter function receives the exporter ASN and the exported
         AS-paths tied for best. The exported AS-paths already include
-        the exporter's ASN. It should return the set of AS-paths that
-        are actually imported (not discarded). The data variable will be
+        the exporter's ASN. It should return the AS-paths that are
+        actually imported (not discarded), either as a list or as any
+        iterable (e.g., a generator). Returning the paths list itself when
+        nothing is discarded avoids a copy. The data variable will be
         passed to the filter function.
 
-        filter(exporter: int, paths: list[ASPath], data) -> list[ASPath]
+        filter(exporter: int, paths: list[ASPath], data) -> Iterable[ASPath]
         """
-        self.g.nodes[asn][NODE_IMPORT_FILTER] = (func, data)
+        if asn not in (self.asn2idx if self.finalized else self.g):
+            raise KeyError(asn)
+        self.import_filters[asn] = (func, data)
+        self._infer_frozen.cache_clear()
+
+    def set_origin_filter(self, asn: int, origins: Iterable[int]) -> None:
+        """Set an import filter for an AS that only accepts paths from origins.
+
+        This is equivalent to set_import_filter(asn, check_origin, origins), which
+        the inference recognizes to accept or discard all paths from an exporter
+        based on their origins without building them.
+        """
+        self.set_import_filter(asn, check_origin, frozenset(origins))
 
     def set_callback(self, when: InferenceCallback, func: Callable) -> None:
         self.callbacks[when] = func
+        self._infer_frozen.cache_clear()
 
     def check_announcement(self, announce: Announcement) -> None:
         """Check all relationships exist and that there are no bogus poisonings."""
+        self.finalize()
         for source, neighbor2path in announce.source2neighbor2path.items():
-            if source not in self.g:
+            if source not in self.asn2idx:
                 raise ValueError(f"Source AS{source} not in ASGraph")
             for neigh, path in neighbor2path.items():
-                if neigh not in self.g[source]:
+                if (neigh, source) not in self.edge_pref:
                     raise ValueError(f"Peering AS{source}-AS{neigh} not in ASGraph")
                 if neigh in path:
                     raise ValueError(f"Neighbor AS{neigh} poisoned in announcement from AS{source} with path {path}")
@@ -245,68 +681,307 @@ class ASGraph:
         care about whether the provider routes traverse a P2P or any number of C2P
         links.
 
-        This function can only be called once, as it adds metadata to self.g nodes and
-        edges. To infer AS-paths for multiple announcements, consider cloning the graph
-        with ASGraph.clone().
+        This function can only be called once, as it stores inference state in the
+        ASGraph. To infer AS-paths for multiple announcements, call
+        ASGraph.reset_inference() between calls, or clone the graph with
+        ASGraph.clone() to keep results around.
         """
 
         assert self.announce is None
+        self.finalize()
         self.check_announcement(announce)
+        store_parents = self.store_paths is not PathStorage.NONE
+        if not store_parents and (self.import_filters or announce.poisons()):
+            raise ValueError("Import filters and poisoning need stored paths")
         self.announce = announce
-
-        for pref in [PathPref.CUSTOMER, PathPref.PEER, PathPref.PROVIDER]:
+        # Drop paths memoized by queries before the inference.
+        self._reset_path_caches()
+        if self.use_jit and numba is not None and self._jit_supported(announce):
+            self._infer_paths_jit(announce)
+            self._store_full_paths()
+            return
+        is_source = bytearray(len(self.idx2asn))
+        for src in announce.source2neighbor2path:
+            is_source[self.asn2idx[src]] = 1
+
+        # Importers that need to inspect exported AS-paths: ASes with import filters
+        # and ASes in announced AS-paths. The latter are the only ones that can find
+        # themselves in exported paths, as breadth-first search never offers an AS a
+        # path through itself as short as the one it already has.
+        needs_paths = bytearray(len(self.idx2asn))
+        for asn in self.import_filters:
+            needs_paths[self.asn2idx[asn]] = 1
+        for neighbor2path in announce.source2neighbor2path.values():
+            for path in neighbor2path.values():
+                for asn in path:
+                    if asn in self.asn2idx:
+                        needs_paths[self.asn2idx[asn]] = 1
+
+        # The loop below inlines _update_paths() and WorkQueue.add_work() for
+        # importers that do not need to inspect paths, keep them in sync.
+        idx2asn = self.idx2asn
+        indptr = self.indptr
+        neighbors = self.neighbors
+        prefs = self.prefs
+        customers_end = self.customers_end
+        path_pref = self.path_pref
+        path_len = self.path_len
+        best_parents = self.best_parents
+        buckets = self.workqueue.buckets
+        get_work = self.workqueue.get
+        add_work = self.workqueue.add_work
+        update_paths = self._update_paths
+        visit_edge = self.callbacks.get(InferenceCallback.VISIT_EDGE)
+
+        self._inferring = True
+        for pref in (PATH_PREF_CUSTOMER, PATH_PREF_PEER, PATH_PREF_PROVIDER):
+            phase = PATH_PREFS[pref]
             if InferenceCallback.START_RELATIONSHIP_PHASE in self.callbacks:
-                self.callbacks[InferenceCallback.START_RELATIONSHIP_PHASE](pref)
+                self.callbacks[InferenceCallback.START_RELATIONSHIP_PHASE](phase)
             self._make_announcements(pref)
-            edge = self.workqueue.get(pref)
-            while edge:
+            while (edge := get_work(pref)) is not None:
                 exporter, importer = edge
-                if InferenceCallback.VISIT_EDGE in self.callbacks:
-                    self.callbacks[InferenceCallback.VISIT_EDGE](
-                        exporter, importer, pref
-                    )
-                if importer in announce.source2neighbor2path:
+                if visit_edge is not None:
+                    visit_edge(idx2asn[exporter], idx2asn[importer], phase)
+                if is_source[importer]:
                     # Do not import route at sources.
-                    edge = self.workqueue.get(pref)
                     continue
-                assert PathPref.from_relationship(self, exporter, importer) == pref
-                if self._update_paths(exporter, importer):
-                    self.workqueue.add_work(self, importer)
-                edge = self.workqueue.get(pref)
+                if needs_paths[importer]:
+                    if update_paths(exporter, importer, pref):
+                        add_work(self, importer)
+                    continue
+
+                current_pref = path_pref[importer]
+                if current_pref > pref:
+                    continue
+                depth = path_len[exporter] + 1
+                if current_pref == pref:
+                    if depth == path_len[importer] and store_parents:
+                        best_parents[importer].append(exporter)
+                        if __debug__:
+                            assert self.workqueue.check_work(self, importer)
+                    continue
+
+                if store_parents:
+                    best_parents[importer] = [exporter]
+                path_len[importer] = depth
+                path_pref[importer] = pref
+                if depth >= len(buckets[PATH_PREF_PROVIDER]):
+                    self.workqueue._grow(depth)
+                # Customer routes go to all neighbors, others only to customers.
+                if pref == PATH_PREF_CUSTOMER:
+                    end = indptr[importer + 1]
+                else:
+                    end = customers_end[importer]
+                for i in range(indptr[importer], end):
+                    buckets[prefs[i]][depth].append((importer, neighbors[i]))
+        self._inferring = False
+        self._store_full_paths()
+
+    def _store_full_paths(self) -> None:
+        """Build the best paths at all ASes if storing PathStorage.FULL."""
+        if self.store_paths is not PathStorage.FULL:
+            return
+        for idx, pref in enumerate(self.path_pref):
+            if pref != PATH_PREF_UNKNOWN:
+                self._best_path_ids(idx)
+
+    def infer_paths_cached(self, announce: Announcement) -> ASGraph:
+        """Return a clone of this ASGraph with paths inferred for announce.
+
+        The INFERENCE_CACHE_SIZE most recently used results are cached by
+        announcement, so the returned graphs are shared and should not be modified.
+        The cache is cleared when peerings, the graph assigned to g, import filters,
+        callbacks, store_paths, or use_jit change.
+        """
+        config = (
+            self.store_paths,
+            self.use_jit,
+            dict(self.import_filters),
+            dict(self.callbacks),
+        )
+        if config != self._infer_config:
+            self._infer_frozen.cache_clear()
+            self._infer_config = config
+        return self._infer_frozen(announce.freeze())
+
+    def _infer_frozen_uncached(self, frozen: FrozenAnnouncement) -> ASGraph:
+        graph = self.clone()
+        graph.callbacks = dict(self.callbacks)
+        graph.infer_paths(Announcement.thaw(frozen))
+        return graph
+
+    def infer_paths_many(
+        self,
+        announces: list[Announcement],
+        nprocs: int | None = None,
+        context: multiprocessing.context.BaseContext | None = None,
+    ) -> list[ASGraph]:
+        """Infer paths for several announcements in parallel.
+
+        Returns one graph with inferred paths per announcement, in order, as if
+        each was inferred on a clone of this ASGraph. Inference runs on nprocs
+        worker processes (os.cpu_count() by default); each worker gets a copy of
+        the topology once and only the per-node inference state is sent back.
+        Callbacks are not supported, as they would run in the workers. Workers are
+        started with the given multiprocessing context, or the default one.
+        """
+        if self.callbacks:
+            raise ValueError("infer_paths_many does not support callbacks")
+        assert self.announce is None
+        self.finalize()
+        nprocs = nprocs or os.cpu_count() or 1
+        nprocs = min(nprocs, len(announces))
+        if nprocs <= 1:
+            states = map(_infer_state, itertools.repeat(self), announces)
+            return list(map(self._with_state, announces, states))
+        chunksize = max(1, len(announces) // (4 * nprocs))
+        context = context or multiprocessing.get_context()
+        with context.Pool(nprocs, _init_worker, (self,)) as pool:
+            states = pool.imap(_infer_worker, announces, chunksize)
+            return list(map(self._with_state, announces, states))
+
+    def _with_state(self, announce: Announcement, state: tuple) -> ASGraph:
+        """Return a clone of this ASGraph with inference state for announce."""
+        graph = self.clone()
+        graph.announce = announce
+        graph.path_pref, graph.path_len, graph.best_parents, graph.fixed_paths = state
+        return graph
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_infer_frozen"]
+        state["_infer_config"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        # The graph may have been pickled where numba is installed.
+        self.use_jit = self.use_jit and numba is not None
+        self._infer_frozen = functools.lru_cache(maxsize=INFERENCE_CACHE_SIZE)(
+            self._infer_frozen_uncached
+        )
+
+    def _jit_supported(self, announce: Announcement) -> bool:
+        """Check if the compiled kernel can run inference for announce.
+
+        The kernel does not run callbacks or import filters, and does not check for
+        AS-path loops. Announced AS-paths can only contain sources (prepending).
+        """
+        if self.callbacks or self.import_filters:
+            return False
+        return not announce.poisons()
+
+    def _infer_paths_jit(self, announce: Announcement) -> None:
+        """Run inference with _infer_kernel() and store its results."""
+        seeds = [
+            (src, nei, aspath)
+            for src, nei2aspath in announce.source2neighbor2path.items()
+            for nei, aspath in nei2aspath.items()
+        ]
+        seed_pref = np.array([self.edge_pref[n, s] for s, n, _ in seeds], np.int8)
+        seed_exporter = np.array([self.asn2idx[s] for s, _, _ in seeds], np.int32)
+        seed_importer = np.array([self.asn2idx[n] for _, n, _ in seeds], np.int32)
+        seed_len = np.array([1 + len(p) for _, _, p in seeds], np.int32)
+        seed_imported = np.zeros(len(seeds), np.int8)
+        is_source = np.zeros(len(self.idx2asn), np.int8)
+        for src in announce.source2neighbor2path:
+            is_source[self.asn2idx[src]] = 1
+        parent_exporter = np.empty(len(self.neighbors), np.int32)
+        parent_importer = np.empty(len(self.neighbors), np.int32)
+
+        nparents = _infer_kernel(
+            np.frombuffer(self.indptr, np.int32),
+            np.frombuffer(self.customers_end, np.int32),
+            np.frombuffer(self.neighbors, np.int32),
+            np.frombuffer(self.prefs, np.int8),
+            is_source,
+            seed_pref,
+            seed_importer,
+            seed_len,
+            seed_imported,
+            np.frombuffer(self.path_pref, np.int8),
+            np.frombuffer(self.path_len, np.int16),
+            parent_exporter,
+            parent_importer,
+        )
+
+        if self.store_paths is PathStorage.NONE:
+            return
+        best_parents = self.best_parents
+        for exporter, importer in zip(
+            parent_exporter[:nparents].tolist(), parent_importer[:nparents].tolist()
+        ):
+            parents = best_parents[importer]
+            if parents is None:
+                best_parents[importer] = [exporter]
+            else:
+                parents.append(exporter)
+        for (src, nei, aspath), imported in zip(seeds, seed_imported.tolist()):
+            if imported:
+                importer = self.asn2idx[nei]
+                self.fixed_paths.setdefault(importer, []).append((src,) + aspath)
 
     def _make_announcements(self, pref: PathPref) -> None:
         """Initialize paths with given pref at neighbors according to announcement."""
 
         assert self.announce is not None
+        source2neighbor2path = self.announce.source2neighbor2path
+        edge_pref = self.edge_pref
+        neighbor_announce = self.callbacks.get(InferenceCallback.NEIGHBOR_ANNOUNCE)
+        asn2idx = self.asn2idx
+        if not any(
+            aspath
+            for nei2aspath in source2neighbor2path.values()
+            for aspath in nei2aspath.values()
+        ):
+            # All announced paths have the same length, no need to sort them.
+            for src, nei2aspath in source2neighbor2path.items():
+                exporter = asn2idx[src]
+                for nei, aspath in nei2aspath.items():
+                    if edge_pref[nei, src] != pref:
+                        continue
+                    if neighbor_announce is not None:
+                        neighbor_announce(src, nei, PATH_PREFS[pref], aspath)
+                    importer = asn2idx[nei]
+                    if self._update_paths(exporter, importer, pref, aspath):
+                        self.workqueue.add_work(self, importer)
+            return
+
         # We sort the calls to update_paths() by path length as update_paths() does not
         # allow paths to get shorter due to the breadth-first search.
         nei2len2srcs: dict[int, dict[int, list[int]]] = defaultdict(
             lambda: defaultdict(list)
         )
-        for src, nei2aspath in self.announce.source2neighbor2path.items():
+        for src, nei2aspath in source2neighbor2path.items():
             for nei, aspath in nei2aspath.items():
-                if PathPref.from_relationship(self, src, nei) != pref:
+                if edge_pref[nei, src] != pref:
                     continue
-                if InferenceCallback.NEIGHBOR_ANNOUNCE in self.callbacks:
-                    announce_path = self.announce.source2neighbor2path[src][nei]
-                    self.callbacks[InferenceCallback.NEIGHBOR_ANNOUNCE](
-                        src, nei, pref, announce_path
-                    )
+                if neighbor_announce is not None:
+                    neighbor_announce(src, nei, PATH_PREFS[pref], aspath)
                 nei2len2srcs[nei][len(aspath)].append(src)
 
         for nei, len2srcs in nei2len2srcs.items():
             # We discard all paths longer than the shortest.
             length = min(len2srcs.keys())
+            importer = asn2idx[nei]
             for src in len2srcs[length]:
-                announce_path = self.announce.source2neighbor2path[src][nei]
-                if self._update_paths(src, nei, announce_path):
-                    self.workqueue.add_work(self, nei)
+                announce_path = source2neighbor2path[src][nei]
+                if self._update_paths(asn2idx[src], importer, pref, announce_path):
+                    self.workqueue.add_work(self, importer)
 
     def _update_paths(
-        self, exporter: int, importer: int, announce_path: tuple[int, ...] | None = None
+        self,
+        exporter: int,
+        importer: int,
+        new_pref: int,
+        announce_path: tuple[int, ...] | None = None,
     ) -> bool:
         """Check for new paths or add paths tied for best at importer.
 
+        The exporter and importer are node indexes, and new_pref is the PathPref of
+        routes learned over the edge between them.
+
         Returns True if importer just got its first paths (work needs to be enqueued).
         Returns False otherwise, including if importer just learned new paths (in this
         case we check that work is already enqueued).
@@ -315,87 +990,474 @@ class ASGraph:
         arbitrary paths at importer. This is used to handle different announcements to
         different neighbors.
         """
-        node = self.g.nodes[importer]
-        new_pref = PathPref.from_relationship(self, exporter, importer)
-        current_pref = node[NODE_PATH_PREF]
+        path_pref = self.path_pref
+        path_len = self.path_len
+        current_pref = path_pref[importer]
 
-        assert current_pref >= new_pref or current_pref == PathPref.UNKNOWN
+        assert current_pref >= new_pref or current_pref == PATH_PREF_UNKNOWN
 
         if current_pref > new_pref:
             return False
 
+        idx2asn = self.idx2asn
+        exporter_asn = idx2asn[exporter]
+        importer_asn = idx2asn[importer]
+        import_filter = self.import_filters.get(importer_asn)
+        if (
+            import_filter is not None
+            and import_filter[0] is check_origin
+            and announce_path is None
+        ):
+            exporter_origins = self._path_origins(exporter)
+            if exporter_origins <= import_filter[1]:
+                import_filter = None
+            elif exporter_origins.isdisjoint(import_filter[1]):
+                return False
+        exported_paths = None
         new_paths = None
-        if announce_path is not None:
-            assert importer not in announce_path
-            new_paths = [(exporter,) + announce_path]
+        if (
+            announce_path is None
+            and import_filter is None
+            and importer_asn not in self._path_asns(exporter)
+        ):
+            # Nothing would be discarded, no need to build the paths.
+            new_path_len = path_len[exporter] + 1
         else:
-            exported_paths = self.g.nodes[exporter][NODE_BEST_PATHS]
-            new_paths = [(exporter,) + p for p in exported_paths if importer not in p]
-
-        if node[NODE_IMPORT_FILTER] is not None:
-            func, data = node[NODE_IMPORT_FILTER]
-            new_paths = func(exporter, new_paths, data)
-        if not new_paths:
-            return False
-
-        new_path_len = len(new_paths[0])
+            if announce_path is not None:
+                assert importer_asn not in announce_path
+                new_paths = [(exporter_asn,) + announce_path]
+            else:
+                exported_paths = self._best_paths(exporter)
+                new_paths = [
+                    (exporter_asn,) + p
+                    for p in exported_paths
+                    if importer_asn not in p
+                ]
+            if import_filter is not None:
+                func, data = import_filter
+                new_paths = func(exporter_asn, new_paths, data)
+                if not isinstance(new_paths, list):
+                    new_paths = list(new_paths)
+            if not new_paths:
+                return False
+            new_path_len = len(new_paths[0])
+
+        if current_pref == PATH_PREF_UNKNOWN:
+            path_len[importer] = new_path_len
+            path_pref[importer] = new_pref
+            self.best_parents[importer] = []
+        else:
+            current_path_len = path_len[importer]
+            assert current_pref == new_pref
+            assert new_path_len >= current_path_len
+            if new_path_len != current_path_len:
+                return False
+
+        # Filters only discard paths, we can point to the exporter if none were.
+        if new_paths is None or (
+            exported_paths is not None and len(new_paths) == len(exported_paths)
+        ):
+            self.best_parents[importer].append(exporter)
+        else:
+            self.fixed_paths.setdefault(importer, []).extend(new_paths)
 
-        if current_pref == PathPref.UNKNOWN:
-            self.g.nodes[importer][NODE_BEST_PATHS] = new_paths
-            self.g.nodes[importer][NODE_PATH_LEN] = new_path_len
-            self.g.nodes[importer][NODE_PATH_PREF] = new_pref
+        if current_pref == PATH_PREF_UNKNOWN:
             return True
-
-        current_path_len = self.g.nodes[importer][NODE_PATH_LEN]
-        assert current_pref == new_pref
-        assert new_path_len >= current_path_len
-
-        if new_path_len == current_path_len:
-            self.g.nodes[importer][NODE_BEST_PATHS].extend(new_paths)
+        if __debug__:
             assert self.workqueue.check_work(self, importer)
-
         return False
 
+    def reconstruct_paths(self, asn: int) -> list[ASPath]:
+        """Return all AS-paths tied for best at asn.
+
+        Paths are built on demand by following best_parents toward the sources, and
+        their interned ids are memoized once the inference is done. Paths read during
+        the inference (e.g., from callbacks) are built without memoizing, as they may
+        still change.
+        """
+        if self.store_paths is PathStorage.NONE:
+            raise ValueError("ASGraph does not store paths (PathStorage.NONE)")
+        self.finalize()
+        if self._inferring:
+            return self._build_paths(self.asn2idx[asn])
+        return self._best_paths(self.asn2idx[asn])
+
+    def _build_paths(self, idx: int) -> list[ASPath]:
+        """Return the current best paths at node idx without memoizing them."""
+        paths = list(self.fixed_paths.get(idx, ()))
+        for parent in self.best_parents[idx] or ():
+            parent_asn = self.idx2asn[parent]
+            paths.extend((parent_asn,) + p for p in self._build_paths(parent))
+        return paths
+
+    def _best_paths(self, idx: int) -> list[ASPath]:
+        return list(map(self._path_tuple, self._best_path_ids(idx)))
+
+    def _best_path_ids(self, idx: int) -> array.array:
+        """Return the interned ids of the best paths at node idx (memoized)."""
+        ids = self.path_ids_cache.get(idx)
+        if ids is None:
+            fixed_paths = self.fixed_paths.get(idx)
+            parents = self.best_parents[idx] or ()
+            if not fixed_paths and len(parents) == 1:
+                # Share the exporter's array, most nodes have a single parent.
+                ids = self._exported_path_ids(parents[0])
+            else:
+                ids = array.array("i", map(self._intern_tuple, fixed_paths or ()))
+                for parent in parents:
+                    ids.extend(self._exported_path_ids(parent))
+            self.path_ids_cache[idx] = ids
+        return ids
+
+    def _exported_path_ids(self, idx: int) -> array.array:
+        """Return ids of the best paths at node idx prepended with its ASN."""
+        ids = self.exported_ids_cache.get(idx)
+        if ids is None:
+            rests = self._best_path_ids(idx)
+            start = len(self.path_hops)
+            self.path_hops.extend(array.array("I", [self.idx2asn[idx]]) * len(rests))
+            self.path_rest.extend(rests)
+            ids = array.array("i", range(start, len(self.path_hops)))
+            self.exported_ids_cache[idx] = ids
+        return ids
+
+    def _intern_tuple(self, path: ASPath) -> int:
+        """Return the id of an AS-path given as a tuple."""
+        pid = -1
+        for hop in reversed(path):
+            key = (hop, pid)
+            if key not in self.path_intern:
+                self.path_intern[key] = len(self.path_hops)
+                self.path_hops.append(hop)
+                self.path_rest.append(pid)
+            pid = self.path_intern[key]
+        return pid
+
+    def _path_tuple(self, pid: int) -> ASPath:
+        path_hops = self.path_hops
+        path_rest = self.path_rest
+        hops = []
+        while pid != -1:
+            hops.append(path_hops[pid])
+            pid = path_rest[pid]
+        return tuple(hops)
+
+    def _path_asns(self, idx: int) -> frozenset[int]:
+        """Return the ASNs in any of the best paths at node idx (memoized)."""
+        asns = self.path_asns_cache.get(idx)
+        if asns is None:
+            union: set[int] = set()
+            for path in self.fixed_paths.get(idx, ()):
+                union.update(path)
+            for parent in self.best_parents[idx] or ():
+                union.add(self.idx2asn[parent])
+                union.update(self._path_asns(parent))
+            asns = frozenset(union)
+            self.path_asns_cache[idx] = asns
+        return asns
+
+    def _path_origins(self, idx: int) -> frozenset[int]:
+        """Return the origins of the best paths at node idx (memoized)."""
+        origins = self.path_origins_cache.get(idx)
+        if origins is None:
+            fixed_paths = self.fixed_paths.get(idx)
+            parents = self.best_parents[idx] or ()
+            if not fixed_paths and len(parents) == 1:
+                origins = self._path_origins(parents[0])
+            else:
+                union = {path[-1] for path in fixed_paths or ()}
+                for parent in parents:
+                    union.update(self._path_origins(parent))
+                origins = frozenset(union)
+            self.path_origins_cache[idx] = origins
+        return origins
+
     def clone(self) -> ASGraph:
-        """Return a deep copy of the current ASGraph."""
+        """Return a deep copy of the current ASGraph.
+
+        The topology is copy-on-write: clones share it until add_peering() is
+        called on either graph.
+        """
         assert self.announce is None
-        graph = ASGraph()
-        graph.g = copy.deepcopy(self.g)
+        graph = ASGraph(self.store_paths)
+        if self.finalized or self._g is None:
+            # The networkx graph is rebuilt from the compact topology if needed.
+            graph._g = None
+        else:
+            # Edge attributes are immutable, networkx's shallow copy is enough.
+            graph._g = self._g.copy()
+            graph._g.asgraph = graph
         graph.workqueue = WorkQueue()
         graph.announce = None
         graph.tier1s = self.tier1s
         graph.ixps = self.ixps
+        graph.import_filters = dict(self.import_filters)
+        graph.use_jit = self.use_jit
+        graph.edge_pref = self.edge_pref
+        graph._edge_pref_shared = self._edge_pref_shared = True
+        if self.finalized:
+            # The compact topology is never modified in place, share it.
+            graph.asn2idx = self.asn2idx
+            graph.idx2asn = self.idx2asn
+            graph.indptr = self.indptr
+            graph.neighbors = self.neighbors
+            graph.rels = self.rels
+            graph.prefs = self.prefs
+            graph.customers_end = self.customers_end
+            graph.has_provider = self.has_provider
+            graph.finalized = True
+            graph.path_pref = array.array("b", self.path_pref)
+            graph.path_len = array.array("h", self.path_len)
+            graph.best_parents = [
+                None if parents is None else list(parents)
+                for parents in self.best_parents
+            ]
+            graph.fixed_paths = {i: list(p) for i, p in self.fixed_paths.items()}
         return graph
 
     @staticmethod
-    def read_caida_asrel_graph(filepath: str | os.PathLike) -> ASGraph:
-        def parse_relationship_line(line):
-            # <provider-as>|<customer-as>|-1
-            # <peer-as>|<peer-as>|0
-            source, sink, rel = line.split("|")
-            return int(source), int(sink), Relationship(int(rel))
+    def read_caida_asrel_graph(
+        filepath: str | os.PathLike, cache: bool = False
+    ) -> ASGraph:
+        """Read an ASGraph from a CAIDA AS-relationship file (bz2-compressed).
+
+        With cache=True, the parsed graph is pickled to filepath + ".pickle" and
+        loaded from there in later calls, unless filepath (or this module) has been
+        modified since.
+        """
+        if not cache:
+            return ASGraph._parse_caida_asrel_graph(filepath)
+        cachepath = os.fspath(filepath) + ".pickle"
+        try:
+            mtime = max(os.path.getmtime(filepath), os.path.getmtime(__file__))
+            if os.path.getmtime(cachepath) >= mtime:
+                with open(cachepath, "rb") as fd:
+                    graph = pickle.load(fd)
+                logging.info("read %s from cache %s", filepath, cachepath)
+                return graph
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            AttributeError,
+            ImportError,
+        ) as e:  # Missing, stale, or unreadable cache, parse again.
+            logging.info("not using cache %s: %s", cachepath, e)
+        graph = ASGraph._parse_caida_asrel_graph(filepath)
+        tmppath = f"{cachepath}.{os.getpid()}.tmp"
+        with open(tmppath, "wb") as fd:
+            pickle.dump(graph, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, cachepath)
+        return graph
 
+    @staticmethod
+    def _parse_caida_asrel_graph(filepath: str | os.PathLike) -> ASGraph:
+        # <provider-as>|<customer-as>|-1
+        # <peer-as>|<peer-as>|0
         graph = ASGraph()
-        cnt = Counter(lines=0, peerings=0)
         with bz2.open(filepath, "rt") as fd:
-            for line in fd:
-                line = line.strip()
-                cnt["lines"] += 1
-                if line[0] == "#":
-                    if line.startswith("# input clique: "):
-                        line = line.replace("# input clique: ", "")
-                        graph.tier1s = set(int(a) for a in line.split())
-                    if line.startswith("# IXP ASes: "):
-                        line = line.replace("# IXP ASes: ", "")
-                        graph.ixps = set(int(a) for a in line.split())
+            text = fd.read()
+        for line in re.findall(r"^#.*$", text, re.MULTILINE):
+            if line.startswith("# input clique: "):
+                line = line.replace("# input clique: ", "")
+                graph.tier1s = set(int(a) for a in line.split())
+            if line.startswith("# IXP ASes: "):
+                line = line.replace("# IXP ASes: ", "")
+                graph.ixps = set(int(a) for a in line.split())
+        # Parse all relationship lines at once rather than line by line.
+        lines = re.sub(r"^#.*$", "", text, flags=re.MULTILINE).split()
+        fields = "|".join(lines).split("|")
+        if len(fields) != 3 * len(lines):
+            raise ValueError(f"{filepath}: relationship lines must have three fields")
+        sources = array.array("I", map(int, fields[0::3]))
+        sinks = array.array("I", map(int, fields[1::3]))
+        rels = array.array("b", map(int, fields[2::3]))
+        if not set(rels) <= {-1, 0, 1}:
+            raise ValueError(f"{filepath}: invalid relationship in {set(rels)}")
+
+        edge_pref = graph.edge_pref
+        edge_pref.update(zip(zip(sinks, sources), map((2).__add__, rels)))
+        edge_pref.update(zip(zip(sources, sinks), map((2).__sub__, rels)))
+        if len(edge_pref) != 2 * len(rels):
+            # Some peerings are repeated, check and drop them like add_peering().
+            edge_pref.clear()
+            keep = bytearray(len(rels))
+            for i, (source, sink, rel) in enumerate(zip(sources, sinks, rels)):
+                assert source != sink
+                pref = edge_pref.get((sink, source))
+                if pref is not None:
+                    if pref != 2 + rel:
+                        raise ValueError("Duplicate edges with different relationships")
                     continue
-                source, sink, rel = parse_relationship_line(line)
-                graph.add_peering(source, sink, rel)
-                cnt["peerings"] += 1
+                edge_pref[sink, source] = 2 + rel
+                edge_pref[source, sink] = 2 - rel
+                keep[i] = True
+            sources = array.array("I", itertools.compress(sources, keep))
+            sinks = array.array("I", itertools.compress(sinks, keep))
+            rels = array.array("b", itertools.compress(rels, keep))
+
+        # Directed edges in both directions, loaded straight into the compact
+        # topology without going through networkx.
+        tails = array.array("I", itertools.chain.from_iterable(zip(sources, sinks)))
+        heads = array.array("I", itertools.chain.from_iterable(zip(sinks, sources)))
+        dirrels = array.array(
+            "b", itertools.chain.from_iterable(zip(rels, map(operator.neg, rels)))
+        )
+        graph._g = None
+        graph._build_topology(dict.fromkeys(tails), tails, heads, dirrels)
         logging.info(
             "read %s: %d lines, %d peering relationships",
             filepath,
-            cnt["lines"],
-            cnt["peerings"],
+            text.count("\n"),
+            len(lines),
         )
         return graph
+
+
+def check_origin(_exporter: int, paths: list[ASPath], origins: Any) -> list[ASPath]:
+    """Import filter that only accepts paths originated by ASes in origins."""
+    if all(p[-1] in origins for p in paths):
+        return paths
+    return [p for p in paths if p[-1] in origins]
+
+
+_worker_graph: ASGraph | None = None
+
+
+def _init_worker(graph: ASGraph) -> None:
+    """Keep the ASGraph sent once to each ASGraph.infer_paths_many() worker."""
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _infer_worker(announce: Announcement) -> tuple:
+    return _infer_state(_worker_graph, announce)
+
+
+def _infer_state(graph: ASGraph, announce: Announcement) -> tuple:
+    """Run inference for announce on graph and return the per-node state."""
+    graph.reset_inference()
+    graph.infer_paths(announce)
+    state = graph.path_pref, graph.path_len, graph.best_parents, graph.fixed_paths
+    graph.reset_inference()
+    return state
+
+
+def _enqueue(
+    indptr, customers_end, neighbors, prefs, node, pref, depth, head, nxt, work, nwork
+):
+    """Push edges exporting paths from node into _infer_kernel()'s work buckets.
+
+    Bucket (pref, depth) is a linked list of work items starting at head[pref,
+    depth] and following nxt. Returns the new number of work items.
+    """
+    end = indptr[node + 1] if pref == PATH_PREF_CUSTOMER else customers_end[node]
+    for i in range(indptr[node], end):
+        downstream_pref = prefs[i]
+        work[nwork, 0] = node
+        work[nwork, 1] = neighbors[i]
+        nxt[nwork] = head[downstream_pref, depth]
+        head[downstream_pref, depth] = nwork
+        nwork += 1
+    return nwork
+
+
+def _infer_kernel(
+    indptr,
+    customers_end,
+    neighbors,
+    prefs,
+    is_source,
+    seed_pref,
+    seed_importer,
+    seed_len,
+    seed_imported,
+    path_pref,
+    path_len,
+    parent_exporter,
+    parent_importer,
+):
+    """Compiled version of ASGraph.infer_paths() over the compact topology.
+
+    Seeds are the announcements, seed_imported is set for those that end up as
+    best paths at their importer. Stores tied (exporter, importer) pairs in the
+    parent arrays and returns how many there are. Nodes only enqueue work once, so
+    all work items and parent pairs fit in arrays as large as neighbors.
+    """
+    n = len(path_pref)
+    maxdepth = n + 1
+    for s in range(len(seed_len)):
+        maxdepth = max(maxdepth, n + seed_len[s])
+    head = np.full((4, maxdepth + 1), -1, np.int32)
+    nxt = np.empty(len(neighbors), np.int32)
+    work = np.empty((len(neighbors), 2), np.int32)
+    nwork = 0
+    nparents = 0
+    seed_minlen = np.full(n, maxdepth, np.int32)
+
+    for pref in (PATH_PREF_CUSTOMER, PATH_PREF_PEER, PATH_PREF_PROVIDER):
+        # Neighbors only import the shortest of the paths announced to them.
+        for s in range(len(seed_pref)):
+            if seed_pref[s] == pref:
+                importer = seed_importer[s]
+                seed_minlen[importer] = min(seed_minlen[importer], seed_len[s])
+        for s in range(len(seed_pref)):
+            importer = seed_importer[s]
+            if seed_pref[s] != pref or seed_len[s] != seed_minlen[importer]:
+                continue
+            current_pref = path_pref[importer]
+            if current_pref > pref:
+                continue
+            if current_pref == pref:
+                if seed_len[s] == path_len[importer]:
+                    seed_imported[s] = 1
+                continue
+            seed_imported[s] = 1
+            path_pref[importer] = pref
+            path_len[importer] = seed_len[s]
+            nwork = _enqueue(
+                indptr, customers_end, neighbors, prefs, importer, pref,
+                seed_len[s], head, nxt, work, nwork,
+            )
+        for s in range(len(seed_pref)):
+            seed_minlen[seed_importer[s]] = maxdepth
+
+        depth = 0
+        while depth <= maxdepth:
+            item = head[pref, depth]
+            if item < 0:
+                depth += 1
+                continue
+            head[pref, depth] = nxt[item]
+            exporter = work[item, 0]
+            importer = work[item, 1]
+            if is_source[importer]:
+                continue
+            current_pref = path_pref[importer]
+            if current_pref > pref:
+                continue
+            new_len = path_len[exporter] + 1
+            if current_pref == pref and new_len != path_len[importer]:
+                continue
+            parent_exporter[nparents] = exporter
+            parent_importer[nparents] = importer
+            nparents += 1
+            if current_pref == pref:
+                continue
+            path_pref[importer] = pref
+            path_len[importer] = new_len
+            nwork = _enqueue(
+                indptr, customers_end, neighbors, prefs, importer, pref,
+                new_len, head, nxt, work, nwork,
+            )
+
+    return nparents
+
+
+# Compile lazily on the first inference rather than at import: explicit signatures
+# would make every import pay for loading (or building) the kernel. cache=True
+# keeps compiled code next to this file so only the first run compiles. The kernel
+# releases the GIL, so threads can run inference on different clones concurrently.
+if numba is not None:
+    _enqueue = numba.njit(cache=True, nogil=True)(_enqueue)
+    _infer_kernel = numba.njit(cache=True, nogil=True)(_infer_kernel)
@@ -17,10 +17,10 @@ CAIDA_AS_RELATIONSHIPS_URL = (
 
 
 def random_inference(graph):
-    sources = random.sample(sorted(graph.g.nodes), 2)
+    sources = random.sample(sorted(graph.nodes), 2)
     announce = Announcement.make_anycast_announcement(graph, sources)
-    g1 = graph.clone()
-    g1.infer_paths(announce)
+    graph.reset_inference()
+    graph.infer_paths(announce)
 
 
 def bench():
@@ -29,7 +29,7 @@ def bench():
     db_filepath = os.path.join("tests", db_filename)
     if not os.path.exists(db_filepath):
         urllib.request.urlretrieve(CAIDA_AS_RELATIONSHIPS_URL, db_filepath)
-    graph = ASGraph.read_caida_asrel_graph(db_filepath)
+    graph = ASGraph.read_caida_asrel_graph(db_filepath, cache=True)
 
     t = timeit.Timer(lambda: random_inference(graph))
     print(t.repeat(repeat=5, number=32))
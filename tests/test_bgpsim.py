@@ -1,19 +1,28 @@
+import bz2
+import concurrent.futures
 import itertools
+import multiprocessing
 import os
 import random
+import tempfile
 import unittest
 import unittest.mock
 import urllib.parse
 import urllib.request
 
+import bgpsim
 from bgpsim import (
     Announcement,
     ASGraph,
+    InferenceCallback,
     PathPref,
+    PathStorage,
     Relationship,
     WorkQueue,
     EDGE_REL,
     NODE_BEST_PATHS,
+    NODE_HAS_PROVIDER,
+    NODE_IMPORT_FILTER,
     NODE_PATH_LEN,
     NODE_PATH_PREF,
 )
@@ -147,10 +156,10 @@ def _make_graph_peer_peer_relationships():
 
 
 def _check_origin(_exporter, paths, origin):
-    return [p for p in paths if p[-1] == origin]
+    return (p for p in paths if p[-1] == origin)
 
 
-def _make_graph_peer_lock():
+def _make_graph_peer_lock(origin_filter=True):
     # Test propagation of hijacked routes through when using peer lock:
     # ASes 2 and 3 peer with AS1, ASes 4 and 5 are providers of AS1.
     # ASes 2 and 4 have peer lock configured with AS1. ASes 6 and 7 are
@@ -184,8 +193,12 @@ def _make_graph_peer_lock():
     graph.add_peering(9, 3, Relationship.P2C)
     graph.add_peering(9, 4, Relationship.P2C)
     graph.add_peering(9, 5, Relationship.P2C)
-    graph.set_import_filter(2, _check_origin, 1)
-    graph.set_import_filter(4, _check_origin, 1)
+    if origin_filter:
+        graph.set_origin_filter(2, [1])
+        graph.set_origin_filter(4, [1])
+    else:
+        graph.set_import_filter(2, _check_origin, 1)
+        graph.set_import_filter(4, _check_origin, 1)
     return graph
 
 
@@ -197,7 +210,7 @@ class TestPathPref(unittest.TestCase):
 
     def test_from_relationship(self):
         graph = _make_graph_implicit_withdrawal()
-        for src, snk, relationship in graph.g.edges.data(EDGE_REL):
+        for src, snk, relationship in graph.edges():
             if relationship == Relationship.P2C:
                 pref = PathPref.from_relationship(graph, src, snk)
                 self.assertEqual(pref, PathPref.PROVIDER)
@@ -250,36 +263,49 @@ class TestWorkQueue(unittest.TestCase):
     def setUp(self):
         # Preconfigure paths for 3 and 7, with longer AS-paths at 7:
         self.graph = _make_graph_implicit_withdrawal()
-        self.graph.g.nodes[3][NODE_BEST_PATHS] = [()]
-        self.graph.g.nodes[3][NODE_PATH_LEN] = 0
-        self.graph.g.nodes[3][NODE_PATH_PREF] = PathPref.CUSTOMER
-        self.graph.g.nodes[7][NODE_BEST_PATHS] = [(7, 7)]
-        self.graph.g.nodes[7][NODE_PATH_LEN] = 2
-        self.graph.g.nodes[7][NODE_PATH_PREF] = PathPref.CUSTOMER
+        self.graph.finalize()
+        self.idx = self.graph.asn2idx
+        self.graph.fixed_paths[self.idx[3]] = [()]
+        self.graph.path_len[self.idx[3]] = 0
+        self.graph.path_pref[self.idx[3]] = PathPref.CUSTOMER
+        self.graph.fixed_paths[self.idx[7]] = [(7, 7)]
+        self.graph.path_len[self.idx[7]] = 2
+        self.graph.path_pref[self.idx[7]] = PathPref.CUSTOMER
         self.workqueue = WorkQueue()
-        self.workqueue.add_work(self.graph, 3)
-        self.workqueue.add_work(self.graph, 7)
+        self.workqueue.add_work(self.graph, self.idx[3])
+        self.workqueue.add_work(self.graph, self.idx[7])
+
+    def edge(self, exporter, importer):
+        return (self.idx[exporter], self.idx[importer])
 
     def test_add_work(self):
-        pref2depth2edge = self.workqueue.pref2depth2edge
-        self.assertEqual(len(pref2depth2edge), 3)
-        self.assertEqual(len(pref2depth2edge[PathPref.CUSTOMER]), 2)
-        self.assertCountEqual(list(pref2depth2edge[PathPref.CUSTOMER]), [0, 2])
-        self.assertEqual(len(pref2depth2edge[PathPref.PROVIDER]), 2)
-        self.assertCountEqual(list(pref2depth2edge[PathPref.PROVIDER]), [0, 2])
-        self.assertEqual(len(pref2depth2edge[PathPref.PEER]), 1)
-        self.assertCountEqual(list(pref2depth2edge[PathPref.PEER]), [0])
+        def depths(pref):
+            buckets = self.workqueue.buckets[pref]
+            return [depth for depth, edges in enumerate(buckets) if edges]
+
+        self.assertEqual(depths(PathPref.UNKNOWN), [])
+        self.assertCountEqual(depths(PathPref.CUSTOMER), [0, 2])
+        self.assertCountEqual(depths(PathPref.PROVIDER), [0, 2])
+        self.assertCountEqual(depths(PathPref.PEER), [0])
 
     def test_get(self):
-        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), (3, 1))
-        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), (7, 5))
+        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), self.edge(3, 1))
+        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), self.edge(7, 5))
         self.assertIsNone(self.workqueue.get(PathPref.CUSTOMER))
-        self.assertEqual(self.workqueue.get(PathPref.PEER), (3, 2))
+        self.assertEqual(self.workqueue.get(PathPref.PEER), self.edge(3, 2))
         self.assertIsNone(self.workqueue.get(PathPref.PEER))
-        self.assertEqual(self.workqueue.get(PathPref.PROVIDER), (3, 8))
-        self.assertEqual(self.workqueue.get(PathPref.PROVIDER), (7, 9))
+        self.assertEqual(self.workqueue.get(PathPref.PROVIDER), self.edge(3, 8))
+        self.assertEqual(self.workqueue.get(PathPref.PROVIDER), self.edge(7, 9))
         self.assertIsNone(self.workqueue.get(PathPref.PROVIDER))
 
+    def test_add_work_below_cursor(self):
+        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), self.edge(3, 1))
+        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), self.edge(7, 5))
+        self.graph.path_len[self.idx[3]] = 1
+        self.workqueue.add_work(self.graph, self.idx[3])
+        self.assertEqual(self.workqueue.get(PathPref.CUSTOMER), self.edge(3, 1))
+        self.assertIsNone(self.workqueue.get(PathPref.CUSTOMER))
+
 
 class TestASGraph(unittest.TestCase):
     def test_duplicate_edges(self):
@@ -604,8 +630,232 @@ class TestASGraph(unittest.TestCase):
             self.assertCountEqual(graph.g.nodes[5][NODE_BEST_PATHS], as5_paths)
             self.assertEqual(graph.g.nodes[5][NODE_PATH_PREF], best_pref)
 
-    def test_peer_lock(self):
+    def test_reset_inference(self):
+        graph = _make_graph_peer_peer_relationships()
+        announce = Announcement.make_anycast_announcement(graph, [2])
+        graph.infer_paths(announce)
+        self.assertEqual(graph.g.nodes[9][NODE_PATH_PREF], PathPref.CUSTOMER)
+
+        graph.reset_inference()
+        self.assertIsNone(graph.announce)
+        for asn in graph.nodes:
+            self.assertEqual(graph.nodes[asn][NODE_PATH_PREF], PathPref.UNKNOWN)
+            self.assertListEqual(graph.nodes[asn][NODE_BEST_PATHS], [])
+
+        announce = Announcement.make_anycast_announcement(graph, [4])
+        graph.infer_paths(announce)
+        self.assertListEqual(graph.nodes[8][NODE_BEST_PATHS], [(7, 10, 3, 4)])
+        self.assertEqual(graph.g.nodes[8][NODE_PATH_PREF], PathPref.PROVIDER)
+        self.assertEqual(graph.nodes[9][NODE_PATH_PREF], PathPref.UNKNOWN)
+
+    def test_topology_change_after_inference(self):
+        graph = _make_graph_implicit_withdrawal()
+        graph.infer_paths(Announcement.make_anycast_announcement(graph, [10]))
+        if __debug__:
+            self.assertRaises(
+                AssertionError, graph.add_peering, 1, 11, Relationship.P2C
+            )
+        g = graph.g.copy()
+        g.add_edge(1, 11, **{EDGE_REL: Relationship.P2C})
+        g.add_edge(11, 1, **{EDGE_REL: Relationship.C2P})
+        graph.g = g
+        self.assertRaises(ValueError, lambda: graph.nodes[8])
+        graph.reset_inference()
+        self.assertIn(11, graph.nodes)
+        graph.infer_paths(Announcement.make_anycast_announcement(graph, [10]))
+        self.assertListEqual(graph.g.nodes[11][NODE_BEST_PATHS], [(1, 10)])
+
+        # Announce from the new AS and turn the 2--3 peering into 2->3 P2C.
+        g = graph.g.copy()
+        g[2][3][EDGE_REL] = Relationship.P2C
+        g[3][2][EDGE_REL] = Relationship.C2P
+        graph.g = g
+        graph.reset_inference()
+        self.assertEqual(PathPref.from_relationship(graph, 3, 2), PathPref.CUSTOMER)
+        self.assertEqual(PathPref.from_relationship(graph, 2, 3), PathPref.PROVIDER)
+        self.assertEqual(PathPref.from_relationship(graph, 11, 1), PathPref.CUSTOMER)
+        for use_jit in (False, True):
+            graph.reset_inference()
+            graph.use_jit = use_jit
+            graph.infer_paths(Announcement.make_anycast_announcement(graph, [11]))
+            self.assertListEqual(graph.g.nodes[1][NODE_BEST_PATHS], [(11,)])
+            self.assertEqual(graph.g.nodes[1][NODE_PATH_PREF], PathPref.CUSTOMER)
+            self.assertListEqual(graph.g.nodes[8][NODE_BEST_PATHS], [(3, 1, 11)])
+            # AS3 does not export provider routes to its new provider AS2.
+            self.assertEqual(graph.g.nodes[2][NODE_PATH_PREF], PathPref.UNKNOWN)
+            graph.reset_inference()
+            graph.infer_paths(Announcement.make_anycast_announcement(graph, [3]))
+            self.assertListEqual(graph.g.nodes[2][NODE_BEST_PATHS], [(3,)])
+            self.assertEqual(graph.g.nodes[2][NODE_PATH_PREF], PathPref.CUSTOMER)
+            self.assertEqual(graph.g.nodes[5][NODE_PATH_PREF], PathPref.PROVIDER)
+
+    def test_infer_paths_cached(self):
+        graph = _make_graph_implicit_withdrawal()
+        announce = Announcement.make_anycast_announcement(graph, [10])
+        g1 = graph.infer_paths_cached(announce)
+        self.assertIsNone(graph.announce)
+        self.assertListEqual(g1.nodes[8][NODE_BEST_PATHS], [(6, 4, 1, 10)])
+        self.assertEqual(g1.nodes[3][NODE_PATH_PREF], PathPref.PEER)
+
+        announce = Announcement.make_anycast_announcement(graph, [10])
+        self.assertIs(graph.infer_paths_cached(announce), g1)
+        graph.add_peering(1, 11, Relationship.P2C)
+        g2 = graph.infer_paths_cached(announce)
+        self.assertIsNot(g2, g1)
+        self.assertListEqual(g2.nodes[11][NODE_BEST_PATHS], [(1, 10)])
+
+        graph.store_paths = PathStorage.NONE
+        g3 = graph.infer_paths_cached(announce)
+        self.assertIsNot(g3, g2)
+        self.assertIsNone(g3.nodes[11][NODE_BEST_PATHS])
+        graph.store_paths = PathStorage.PARENTS
+        graph.import_filters[11] = (lambda _exporter, _paths, _data: [], None)
+        g4 = graph.infer_paths_cached(announce)
+        self.assertEqual(g4.nodes[11][NODE_PATH_PREF], PathPref.UNKNOWN)
+
+        g = graph.g.copy()
+        g.add_edge(1, 12, **{EDGE_REL: Relationship.P2C})
+        g.add_edge(12, 1, **{EDGE_REL: Relationship.C2P})
+        graph.g = g
+        g5 = graph.infer_paths_cached(announce)
+        self.assertIsNot(g5, g4)
+        self.assertListEqual(g5.nodes[12][NODE_BEST_PATHS], [(1, 10)])
+
+    def test_path_storage(self):
+        graph = _make_graph_implicit_withdrawal()
+        announce = Announcement.make_anycast_announcement(graph, [10])
+        expected = graph.clone()
+        expected.infer_paths(announce)
+        for store_paths in PathStorage:
+            graph.store_paths = store_paths
+            g1 = graph.clone()
+            g1.infer_paths(announce)
+            for asn in graph.nodes:
+                node = dict(expected.nodes[asn])
+                if store_paths is PathStorage.NONE:
+                    node[NODE_BEST_PATHS] = None
+                self.assertEqual(g1.nodes[asn], node)
+
+        peer_lock = _make_graph_peer_lock()
+        peer_lock.store_paths = PathStorage.NONE
+        announce = Announcement.make_anycast_announcement(peer_lock, [1])
+        self.assertRaises(ValueError, peer_lock.infer_paths, announce)
+
+    def test_node_view(self):
+        graph = _make_graph_implicit_withdrawal()
+        graph.infer_paths(Announcement.make_anycast_announcement(graph, [10]))
+        self.assertEqual(graph.nodes[8][NODE_PATH_LEN], 4)
+        self.assertEqual(graph.path_ids_cache, {})
+        self.assertEqual(
+            dict(graph.nodes[8]),
+            {
+                NODE_BEST_PATHS: [(6, 4, 1, 10)],
+                NODE_PATH_PREF: PathPref.PROVIDER,
+                NODE_PATH_LEN: 4,
+                NODE_IMPORT_FILTER: None,
+                NODE_HAS_PROVIDER: True,
+            },
+        )
+        self.assertRaises(KeyError, graph.nodes.__getitem__, 11)
+
+        graph.reset_inference()
+        graph.infer_paths(Announcement.make_anycast_announcement(graph, [9]))
+        self.assertEqual(graph.nodes[1][NODE_PATH_PREF], PathPref.UNKNOWN)
+        self.assertNotIn(NODE_PATH_LEN, graph.g.nodes[1])
+        self.assertRaises(KeyError, graph.nodes[1].__getitem__, NODE_PATH_LEN)
+        self.assertEqual(len(graph.nodes[1]), len(dict(graph.nodes[1])))
+
+    def test_interned_paths(self):
+        graph = _make_graph_multiple_choices()
+        graph.infer_paths(Announcement.make_anycast_announcement(graph, [1]))
+        idx = graph.asn2idx
+        for asn in (8, 9, 10):
+            self.assertEqual(graph._best_path_ids(idx[asn]), graph._best_path_ids(idx[8]))
+        self.assertCountEqual(
+            graph.nodes[11][NODE_BEST_PATHS],
+            [(a, 5, b, 1) for a in (8, 9, 10) for b in (2, 3, 4)],
+        )
+        # One path at ASes 2-4, 3 at AS5, 3 shared by ASes 8-10, and 9 at AS11.
+        self.assertEqual(len(graph.path_hops), 1 + 3 + 3 + 9)
+        path = graph._intern_tuple((8, 5, 2, 1))
+        self.assertEqual(graph._path_tuple(path), (8, 5, 2, 1))
+
+    def test_clone(self):
+        graph = _make_graph_implicit_withdrawal()
+        g1 = graph.clone()
+        g1.add_peering(1, 11, Relationship.P2C)
+        self.assertIn(11, g1.g)
+        self.assertNotIn(11, graph.g)
+        self.assertEqual(g1.g[1][10][EDGE_REL], graph.g[1][10][EDGE_REL])
+        self.assertNotIn((11, 1), graph.edge_pref)
+        graph.add_peering(1, 12, Relationship.P2C)
+        self.assertNotIn(12, g1.g)
+        self.assertNotIn((12, 1), g1.edge_pref)
+
+    def test_read_paths_from_callback(self):
+        graph = _make_graph_multiple_choices()
+        announce = Announcement.make_anycast_announcement(graph, [1])
+        expected = graph.clone()
+        expected.infer_paths(announce)
+
+        def read_all_paths(_exporter, _importer, _phase):
+            for asn in graph.nodes:
+                graph.nodes[asn][NODE_BEST_PATHS]
+
+        graph.set_callback(InferenceCallback.VISIT_EDGE, read_all_paths)
+        graph.infer_paths(announce)
+        for asn in graph.nodes:
+            self.assertEqual(graph.nodes[asn], expected.nodes[asn])
+
+    def test_edges(self):
         graph = _make_graph_peer_lock()
+        edges = list(graph.edges())
+        self.assertCountEqual(edges, graph.g.edges.data(EDGE_REL))
+        graph.add_peering(1, 10, Relationship.P2C)
+        self.assertCountEqual(graph.edges(), edges + [(1, 10, -1), (10, 1, 1)])
+
+    def test_read_caida_asrel_graph_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, "test.as-rel.txt.bz2")
+            with bz2.open(filepath, "wt") as fd:
+                fd.write("# input clique: 1\n1|2|-1\n2|3|0\n1|3|-1\n")
+            graph = ASGraph.read_caida_asrel_graph(filepath, cache=True)
+            self.assertTrue(os.path.exists(filepath + ".pickle"))
+            with unittest.mock.patch.object(ASGraph, "_parse_caida_asrel_graph") as m:
+                cached = ASGraph.read_caida_asrel_graph(filepath, cache=True)
+                m.assert_not_called()
+            self.assertEqual(cached.tier1s, {1})
+            with unittest.mock.patch.object(bgpsim, "numba", None):
+                cached_nojit = ASGraph.read_caida_asrel_graph(filepath, cache=True)
+            self.assertFalse(cached_nojit.use_jit)
+            announce = Announcement.make_anycast_announcement(graph, [3])
+            graph.infer_paths(announce)
+            cached.infer_paths(announce)
+            for asn in graph.nodes:
+                self.assertEqual(graph.nodes[asn], cached.nodes[asn])
+
+    def test_infer_paths_many(self):
+        graph = _make_graph_peer_lock()
+        announces = [
+            Announcement.make_anycast_announcement(graph, sources)
+            for sources in ([1], [3], [5], [1, 7])
+        ]
+        spawn = multiprocessing.get_context("spawn")
+        for nprocs, context in ((1, None), (2, None), (2, spawn)):
+            graphs = graph.infer_paths_many(announces, nprocs, context)
+            self.assertIsNone(graph.announce)
+            for announce, g1 in zip(announces, graphs):
+                g2 = graph.clone()
+                g2.infer_paths(announce)
+                for asn in graph.nodes:
+                    self.assertEqual(g1.nodes[asn], g2.nodes[asn])
+
+    def test_peer_lock(self):
+        for origin_filter in (True, False):
+            with self.subTest(origin_filter=origin_filter):
+                self._check_peer_lock(_make_graph_peer_lock(origin_filter))
+
+    def _check_peer_lock(self, graph):
 
         announce = Announcement.make_anycast_announcement(graph, [1, 7])
         graph.infer_paths(announce)
@@ -636,18 +886,80 @@ class TestASGraph(unittest.TestCase):
         self.assertEqual(graph.g.nodes[9][NODE_PATH_PREF], PathPref.CUSTOMER)
 
 
+@unittest.skipIf(bgpsim.numba is None, "numba not installed")
+class TestJitKernel(unittest.TestCase):
+    def check_same_paths(self, graph, announce):
+        g1 = graph.clone()
+        g1.infer_paths(announce)
+        g2 = graph.clone()
+        g2.use_jit = False
+        g2.infer_paths(announce)
+        for asn in graph.nodes:
+            n1 = g1.nodes[asn]
+            n2 = g2.nodes[asn]
+            self.assertCountEqual(n1[NODE_BEST_PATHS], n2[NODE_BEST_PATHS])
+            self.assertEqual(n1[NODE_PATH_PREF], n2[NODE_PATH_PREF])
+            self.assertEqual(n1.get(NODE_PATH_LEN), n2.get(NODE_PATH_LEN))
+
+    def test_matches_python(self):
+        graph_makers = [
+            _make_graph_implicit_withdrawal,
+            _make_graph_implicit_withdrawal_multihop,
+            _make_graph_preferred,
+            _make_graph_multiple_choices,
+            _make_graph_peer_peer_relationships,
+        ]
+        for make_graph in graph_makers:
+            graph = make_graph()
+            self.assertTrue(graph.use_jit)
+            for sources in itertools.combinations(graph.nodes, 2):
+                announce = Announcement.make_anycast_announcement(graph, list(sources))
+                self.check_same_paths(graph, announce)
+                announce = Announcement.make_anycast_announcement(
+                    graph, {sources[0]: 1, sources[1]: 0}
+                )
+                self.check_same_paths(graph, announce)
+
+    def test_threads(self):
+        graph = _make_graph_multiple_choices()
+        announces = [
+            Announcement.make_anycast_announcement(graph, list(sources))
+            for sources in itertools.combinations(graph.nodes, 2)
+        ]
+        graphs = [graph.clone() for _ in announces]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(ASGraph.infer_paths, graphs, announces))
+        for announce, g1 in zip(announces, graphs):
+            g2 = graph.clone()
+            g2.infer_paths(announce)
+            for asn in graph.nodes:
+                self.assertEqual(g1.nodes[asn], g2.nodes[asn])
+
+    def test_unsupported(self):
+        graph = _make_graph_peer_lock()
+        announce = Announcement.make_anycast_announcement(graph, [1, 7])
+        self.assertFalse(graph._jit_supported(announce))
+        graph = _make_graph_multiple_choices()
+        announce = Announcement.make_anycast_announcement(graph, [2])
+        self.assertTrue(graph._jit_supported(announce))
+        announce.source2neighbor2path[2][5] = (3, 2)
+        self.assertFalse(graph._jit_supported(announce))
+
+
 def workqueue_random_get(self, pref):
     TAIL_SHUFFLE = 5
     assert isinstance(self, WorkQueue)
-    if not self.pref2depth2edge[pref]:
+    buckets = self.buckets[pref]
+    while self.cur_depth[pref] < len(buckets) and not buckets[self.cur_depth[pref]]:
+        self.cur_depth[pref] += 1
+    if self.cur_depth[pref] == len(buckets):
         return None
-    depth = min(self.pref2depth2edge[pref])
-    nedges = len(self.pref2depth2edge[pref][depth])
-    index = random.randint(max(0, nedges - TAIL_SHUFFLE), nedges - 1)
-    edge = self.pref2depth2edge[pref][depth][index]
-    del self.pref2depth2edge[pref][depth][index]
-    if not self.pref2depth2edge[pref][depth]:
-        del self.pref2depth2edge[pref][depth]
+    bucket = buckets[self.cur_depth[pref]]
+    nedges = len(bucket)
+    # random.random() is much cheaper than random.randint() in this hot path.
+    index = nedges - 1 - int(random.random() * min(nedges, TAIL_SHUFFLE))
+    edge = bucket[index]
+    del bucket[index]
     return edge
 
 
@@ -660,40 +972,53 @@ class TestCaidaASGraph(unittest.TestCase):
         db_filepath = os.path.join("tests", db_filename)
         if not os.path.exists(db_filepath):
             urllib.request.urlretrieve(CAIDA_AS_RELATIONSHIPS_URL, db_filepath)
-        cls.graph = ASGraph.read_caida_asrel_graph(db_filepath)
+        cls.graph = ASGraph.read_caida_asrel_graph(db_filepath, cache=True)
 
     def setUp(self):
         self.graph = TestCaidaASGraph.graph.clone()
 
+    def assert_paths_equal(self, paths1, paths2):
+        # Cheaper than assertCountEqual() when called for every AS.
+        self.assertEqual(sorted(paths1), sorted(paths2))
+
     def test_load_caida_asrel(self):
         self.assertIsNotNone(self.graph)
         self.assertGreater(len(self.graph.tier1s), 1)
         self.assertGreater(len(self.graph.ixps), 1)
 
+    @unittest.skipIf(
+        "fork" not in multiprocessing.get_all_start_methods(),
+        "workers only keep the patched WorkQueue.get when forked",
+    )
     @unittest.mock.patch.object(WorkQueue, "get", workqueue_random_get)
     def test_random_sources_on_caida_graph(self):
         SETS = 5
         ITERATIONS = 3
 
         for setnum in range(SETS):
-            sources = random.sample(sorted(self.graph.g.nodes), 3)
+            sources = random.sample(sorted(self.graph.nodes), 3)
             announce = Announcement.make_anycast_announcement(self.graph, sources)
             self.assertCountEqual(announce.source2neighbor2path.keys(), sources)
 
             g1 = self.graph.clone()
             g1.infer_paths(announce)
 
-            for iternum in range(ITERATIONS):
+            # Iterations run in parallel. Workers are forked so they keep the
+            # patched WorkQueue.get and still visit edges in a random order.
+            graph = self.graph.clone()
+            graph.use_jit = False
+            g2s = graph.infer_paths_many(
+                [announce] * ITERATIONS, ITERATIONS, multiprocessing.get_context("fork")
+            )
+            for iternum, g2 in enumerate(g2s):
                 print(f"source set {setnum}/{SETS}, iteration {iternum}/{ITERATIONS}")
 
-                g2 = self.graph.clone()
-                g2.infer_paths(announce)
-
-                for nodenum in g1.g.nodes:
-                    n1_paths = g1.g.nodes[nodenum][NODE_BEST_PATHS]
-                    n2_paths = g2.g.nodes[nodenum][NODE_BEST_PATHS]
-                    self.assertCountEqual(n1_paths, n2_paths)
+                # Clones do not build networkx graphs, read from graph.nodes.
+                for nodenum in g1.nodes:
+                    n1_paths = g1.nodes[nodenum][NODE_BEST_PATHS]
+                    n2_paths = g2.nodes[nodenum][NODE_BEST_PATHS]
+                    self.assert_paths_equal(n1_paths, n2_paths)
                     self.assertEqual(
-                        g1.g.nodes[nodenum][NODE_PATH_PREF],
-                        g2.g.nodes[nodenum][NODE_PATH_PREF],
+                        g1.nodes[nodenum][NODE_PATH_PREF],
+                        g2.nodes[nodenum][NODE_PATH_PREF],
                     )